@@ -6,6 +6,58 @@ Created on Mon Sep 6 09:19:41 2021
 @author: Naveen GOUTHAM
 """
 import numpy as np
+from functools import lru_cache
+
+# Single-pass kernels, fastest first: numba, then the Cython extension built by setup.py, else the NumPy closed form.
+try:
+    from ._kernels import crps_sorted as _crps_sorted
+except ImportError:
+    try:
+        from ._crps_c import crps_sorted as _crps_sorted
+    except ImportError:
+        _crps_sorted = None
+
+@lru_cache(maxsize=32)
+def _rank_weights(m, dtype=np.float64):
+    '''
+    Returns the read-only weights (2e-1)/m^2, e = 1..m, of the sorted ensemble members. Reversed, they give (2m+1-2e)/m^2.
+    '''
+    idx = np.arange(1, m + 1, dtype=dtype)
+    w = (2*idx - 1) / (m*m)
+    w.setflags(write=False)
+    return w
+
+@lru_cache(maxsize=32)
+def _spread_weights(m, dtype=np.float64):
+    '''
+    Returns the read-only weights (2e-m-1)/m^2, e = 1..m, whose product with the sorted ensemble is the integral of F(y) (1 - F(y)) dy.
+    '''
+    w = _rank_weights(m, dtype)
+    v = (w - w[::-1]) / 2
+    v.setflags(write=False)
+    return v
+
+# Largest ensemble for which the kernel form sums the member pairs directly; beyond it the O(m^2) double sum
+# is replaced by the equivalent sorted weighted sum.
+_KERNEL_PAIRWISE_MAX = 64
+
+def _crps_kernel(fc, obs, M):
+    '''
+    Returns crps, fcrps and acrps from the kernel form crps = mean|x_e - y| - sum|x_i - x_j| / (2 m^2) (Gneiting and Raftery, 2007),
+    with the fair normalisation 1/(2 m (m-1)) of the pair term for fcrps (Ferro et al., 2008). fc must be sorted when m exceeds _KERNEL_PAIRWISE_MAX.
+    '''
+    m = fc.size
+    abs_err = np.abs(fc - obs).mean()
+    if m <= _KERNEL_PAIRWISE_MAX:
+        pairs = np.abs(fc[:, None] - fc[None, :]).sum()
+    else:
+        pairs = np.dot(_spread_weights(m, fc.dtype), fc) * (2*m*m)
+    crps = abs_err - pairs / (2*m*m)
+    if m == 1:
+        return crps, np.nan, np.nan
+    # crps - correction equals abs_err - pairs / (2 m (m-1)).
+    correction = pairs / (2*m*m*(m - 1))
+    return crps, crps - correction, crps - (1 - (m/M)) * correction
 
 class CRPS:
     '''
@@ -22,7 +74,7 @@ class CRPS:
     
     Parameters:
         ensemble_members: numpy.ndarray
-            The predicted ensemble members. They will be sorted automatically.
+            The predicted ensemble members. They will be sorted automatically. Repeated members are kept and each counts as a separate member.
             Ex: np.array([2.1,3.5,4.7,1.2,1.3,5.2,5.3,4.2,3.1,1.7])
             
         observation: float
@@ -33,13 +85,22 @@ class CRPS:
             The size the ensemble needs to be adjusted to before computing the Adjusted Continuous Ranked Probability Score.
             The default is 200. 
             Note: The crps becomes equal to acrps when adjusted_ensemble_size equals the length of the ensemble_members.
+
+        dtype: numpy dtype, optional
+            The floating point type the ensemble members are stored and scored in.
+            The default is np.float64. np.float32 halves the memory of large ensembles at the cost of precision.
+
+        already_sorted: bool, optional
+            Set to True when ensemble_members are already in ascending order to skip the sort, e.g. when scoring many observations against one ensemble.
+            The default is False.
     
     ----------
     
     Method(s):
             
-        compute():
+        compute(method='sorted'):
             Computes the continuous ranked probability score (crps), the fair-crps (fcrps), and the adjusted-crps (acrps).
+            method='sorted' integrates over the sorted ensemble, method='kernel' uses the equivalent kernel (energy) form.
 
     ----------
             
@@ -64,7 +125,10 @@ class CRPS:
             .. math::
             \mathrm{acrps = crps - \int_{-\infty}^{\infty} [(1 - m/M) F(y) (1 - F(y))/(m-1)] dy},
             
-            where M is the adjusted_ensemble_size
+            where M is the adjusted_ensemble_size. The integrand is that of fcrps scaled by (1 - m/M), so
+            
+            .. math::
+            \mathrm{acrps = crps - (1 - m/M) (crps - fcrps)}
             
     ----------
     
@@ -87,7 +151,7 @@ class CRPS:
 	Out[5]: 1.4833333333333336
         
     '''
-    def __init__(self,ensemble_members,observation,adjusted_ensemble_size=200):
+    def __init__(self,ensemble_members,observation,adjusted_ensemble_size=200,dtype=np.float64,already_sorted=False):
         '''
         Parameters:
             ensemble_members: numpy.ndarray
@@ -100,19 +164,25 @@ class CRPS:
                 The size the ensemble needs to be adjusted to before computing the Adjusted Continuous Ranked Probability Score.
                 The default is 200. 
                 Note: The crps becomes equal to acrps when adjusted_ensemble_size equals the length of the ensemble_members.
+            dtype: numpy dtype, optional
+                The floating point type the ensemble members are stored and scored in.
+                The default is np.float64.
+            already_sorted: bool, optional
+                Set to True when ensemble_members are already in ascending order to skip the sort. The members are then not copied.
+                The default is False.
         
         Returns
         -------
         None
             
         '''
-        self.fc = np.sort(ensemble_members)
-        self.ob = observation
+        self.fc = np.ascontiguousarray(ensemble_members, dtype=dtype)
+        if not already_sorted:
+            self.fc = np.sort(self.fc)
+        self.ob = float(observation)
         self.__m = len(self.fc)
         self.M = int(adjusted_ensemble_size)
-        self.__cdf_fc = None
-        self.__cdf_ob = None
-        self.__delta_fc = None
+        self.__finite = bool(np.isfinite(self.ob) and np.isfinite(self.fc).all())
         self.crps = None
         self.fcrps = None
         self.acrps = None
@@ -120,64 +190,93 @@ class CRPS:
     def __str__(self):
         "Kindly refer to the __doc__ method for documentation. i.e. print(CRPS.__doc__)."
             
-    def compute(self):
+    def compute(self, method='sorted'):
         '''
+        Parameters:
+            method: str, optional
+                'sorted' evaluates the closed form over the sorted ensemble (Hersbach, 2000).
+                'kernel' evaluates crps = mean|x_e - y| - sum|x_i - x_j| / (2 m^2) (Gneiting and Raftery, 2007).
+                The default is 'sorted'.
+
         Returns
         -------
-        crps, fair-crps, adjusted-crps
+        crps, fair-crps, adjusted-crps as float
+            NaN for all three when the observation or any ensemble member is NaN or infinite.
+            fcrps and acrps are NaN for a single member.
         
         '''
-        if (self.ob is not np.nan) and (not np.isnan(self.fc).any()):
-            if self.ob < self.fc[0]:
-                self.__cdf_fc = np.linspace(0,(self.__m - 1)/self.__m,self.__m)
-                self.__cdf_ob = np.ones(self.__m)
-                all_mem = np.array([self.ob] + list(self.fc), dtype = object)
-                self.__delta_fc = np.array([all_mem[n+1] - all_mem[n] for n in range(len(all_mem)-1)], dtype=object)
-                
-            elif self.ob > self.fc[-1]:
-                self.__cdf_fc = np.linspace(1/self.__m,1,self.__m)
-                self.__cdf_ob = np.zeros(self.__m)
-                all_mem = np.array(list(self.fc) + [self.ob], dtype = object)
-                self.__delta_fc = np.array([all_mem[n+1] - all_mem[n] for n in range(len(all_mem)-1)], dtype=object) 
-    
-            elif self.ob in self.fc:
-                self.__cdf_fc = np.linspace(1/self.__m,1,self.__m)
-                self.__cdf_ob = (self.fc >= self.ob)
-                all_mem = self.fc
-                self.__delta_fc = np.array([all_mem[n+1] - all_mem[n] for n in range(len(all_mem)-1)] + list(np.zeros(1)), dtype=object) 
-    
-            else:
-                cdf_fc = []
-                cdf_ob = []
-                delta_fc = []
-                for f in range(len(self.fc)-1):
-                    if (self.fc[f] < self.ob) and (self.fc[f+1] < self.ob):
-                        cdf_fc.append((f+1)*1/self.__m)
-                        cdf_ob.append(0)
-                        delta_fc.append(self.fc[f+1] - self.fc[f])
-                    elif (self.fc[f] < self.ob) and (self.fc[f+1] > self.ob):
-                        cdf_fc.append((f+1)*1/self.__m)
-                        cdf_fc.append((f+1)*1/self.__m)
-                        cdf_ob.append(0)
-                        cdf_ob.append(1)
-                        delta_fc.append(self.ob - self.fc[f])
-                        delta_fc.append(self.fc[f+1] - self.ob)
-                    else:
-                        cdf_fc.append((f+1)*1/self.__m)
-                        cdf_ob.append(1)
-                        delta_fc.append(self.fc[f+1] - self.fc[f])
-                self.__cdf_fc = np.array(cdf_fc)
-                self.__cdf_ob = np.array(cdf_ob)
-                self.__delta_fc = np.array(delta_fc)
-            
-            self.crps = np.sum(np.array((self.__cdf_fc - self.__cdf_ob) ** 2)*self.__delta_fc)
-            if self.__m == 1:
-                self.fcrps = self.acrps = 'Not defined'
+        if method not in ('sorted', 'kernel'):
+            raise ValueError("method must be 'sorted' or 'kernel', got %r" % (method,))
+        if self.__finite:
+            s = self.fc
+            m = self.__m
+            if method == 'kernel':
+                crps, fcrps, acrps = _crps_kernel(s, self.ob, self.M)
+            elif _crps_sorted is not None:
+                crps, fcrps, acrps = _crps_sorted(s, self.ob, self.M)
             else:
-                self.fcrps = self.crps - np.sum(np.array(((self.__cdf_fc * (1 - self.__cdf_fc))/(self.__m-1))*self.__delta_fc))
-                self.acrps = self.crps - np.sum(np.array((((1 - (self.__m/self.M)) * self.__cdf_fc * (1 - self.__cdf_fc))/(self.__m-1))*self.__delta_fc))
-            return self.crps, self.fcrps, self.acrps
+                # Closed form of the integral over the sorted ensemble (Hersbach, 2000):
+                # members at or below the observation are weighted by (2e-1)/m^2, those above by (2m+1-2e)/m^2.
+                k = np.searchsorted(s, self.ob, side='right')
+                w = _rank_weights(m, s.dtype)
+                crps = np.dot(w[:k], self.ob - s[:k]) + np.dot(w[::-1][k:], s[k:] - self.ob)
+                fcrps = acrps = np.nan
+                if m > 1:
+                    # Integral of F(y) (1 - F(y)) dy over the ensemble, i.e. half the mean absolute difference between members.
+                    spread = np.dot(_spread_weights(m, s.dtype), s)
+                    correction = spread/(m - 1)
+                    fcrps = crps - correction
+                    acrps = crps - (1 - (m/self.M)) * correction
+            self.crps, self.fcrps, self.acrps = float(crps), float(fcrps), float(acrps)
         else:
-            return np.nan, np.nan, np.nan
-        
-        
\ No newline at end of file
+            self.crps = self.fcrps = self.acrps = np.nan
+        return self.crps, self.fcrps, self.acrps
+
+
+def crps_ensemble(ensemble_members, observations, adjusted_ensemble_size=200, axis=-1, dtype=np.float64, already_sorted=False):
+    '''
+    Computes the crps, the fcrps, and the acrps for a whole field of ensemble predictions and observations at once.
+
+    Parameters:
+        ensemble_members: numpy.ndarray
+            The predicted ensemble members, with the members along axis. They will be sorted automatically.
+            Ex: np.random.randn(180,360,50)
+        observations: numpy.ndarray or float
+            The observed values, broadcastable to the shape of ensemble_members without axis.
+            Many observations can be scored against one ensemble by giving them a trailing dimension the ensemble lacks.
+            Ex: np.random.randn(180,360)
+        adjusted_ensemble_size: int, optional
+            The size the ensemble needs to be adjusted to before computing the Adjusted Continuous Ranked Probability Score.
+            The default is 200.
+        axis: int, optional
+            The axis of ensemble_members holding the members. The default is -1.
+        dtype: numpy dtype, optional
+            The floating point type the field is scored in. The default is np.float64; np.float32 halves the memory of large fields.
+        already_sorted: bool, optional
+            Set to True when ensemble_members are already in ascending order along axis to skip the sort. The default is False.
+
+    Returns
+    -------
+    crps, fair-crps, adjusted-crps as numpy.ndarray
+        Points with a NaN member or observation are NaN. fcrps and acrps are NaN for a single member.
+
+    '''
+    s = np.moveaxis(np.asarray(ensemble_members, dtype=dtype), axis, -1)
+    if not already_sorted:
+        s = np.sort(s, axis=-1)
+    ob = np.asarray(observations, dtype=dtype)
+    m = s.shape[-1]
+    M = int(adjusted_ensemble_size)
+    # Integral of F(y) (1 - F(y)) dy, i.e. half the mean absolute difference between members, and
+    # crps = mean |x_e - y| - spread (Gneiting and Raftery, 2007).
+    # The spread weights sum to zero, so both terms are reduced from the single buffer d = x_e - y.
+    d = s - ob[..., None]
+    spread = d @ _spread_weights(m, s.dtype)
+    crps = np.abs(d, out=d).mean(axis=-1) - spread
+    if m == 1:
+        nan = np.full_like(crps, np.nan)
+        return crps, nan, nan.copy()
+    correction = spread/(m - 1)
+    fcrps = crps - correction
+    acrps = crps - (1 - (m/M)) * correction
+    return crps, fcrps, acrps
@@ -1 +1 @@
-from .CRPS import CRPS
+from .CRPS import CRPS, crps_ensemble
\ No newline at end of file
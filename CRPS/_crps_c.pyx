@@ -0,0 +1,51 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled kernel for the sorted-ensemble CRPS. setup.py builds it when Cython and a C compiler are available.
+
+@author: Naveen GOUTHAM
+"""
+cimport cython
+from libc.math cimport NAN
+
+cdef inline (double, double, double) _crps_kernel(const cython.floating[::1] s, double obs, double M) noexcept nogil:
+    cdef Py_ssize_t m = s.shape[0]
+    cdef Py_ssize_t e
+    cdef double u, correction
+    cdef double crps = 0.0
+    cdef double spread = 0.0
+    for e in range(1, m + 1):
+        u = s[e - 1]
+        if u <= obs:
+            crps += (2*e - 1) * (obs - u)
+        else:
+            crps += (2*m + 1 - 2*e) * (u - obs)
+        spread += (2*e - m - 1) * u
+    crps /= <double>(m*m)
+    spread /= <double>(m*m)
+    if m < 2:
+        return crps, NAN, NAN
+    correction = spread/(m - 1)
+    return crps, crps - correction, crps - (1 - m/M) * correction
+
+def crps_sorted(const cython.floating[::1] s, double obs, M):
+    '''
+    Computes crps, fcrps and acrps in a single pass over the sorted ensemble s.
+
+    Parameters:
+        s: numpy.ndarray
+            The ensemble members sorted in ascending order, C-contiguous float32 or float64, free of NaNs.
+        obs: float
+            The observed value.
+        M: int
+            The adjusted ensemble size.
+
+    Returns
+    -------
+    crps, fair-crps, adjusted-crps (fcrps and acrps are NaN for a single member)
+
+    '''
+    cdef double M_ = M
+    cdef (double, double, double) result
+    with nogil:
+        result = _crps_kernel(s, obs, M_)
+    return result
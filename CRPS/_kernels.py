@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Numba kernels for the sorted-ensemble CRPS. Importing this module raises ImportError when numba is not installed.
+
+@author: Naveen GOUTHAM
+"""
+import numpy as np
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def crps_sorted(s, obs, M):
+    '''
+    Computes crps, fcrps and acrps in a single pass over the sorted ensemble s.
+
+    Parameters:
+        s: numpy.ndarray
+            The ensemble members sorted in ascending order, free of NaNs.
+        obs: float
+            The observed value.
+        M: int
+            The adjusted ensemble size.
+
+    Returns
+    -------
+    crps, fair-crps, adjusted-crps (fcrps and acrps are NaN for a single member)
+
+    '''
+    m = s.shape[0]
+    crps = 0.0
+    spread = 0.0
+    for e in range(1, m + 1):
+        u = s[e - 1]
+        if u <= obs:
+            crps += (2*e - 1) * (obs - u)
+        else:
+            crps += (2*m + 1 - 2*e) * (u - obs)
+        spread += (2*e - m - 1) * u
+    crps /= m*m
+    spread /= m*m
+    if m < 2:
+        return crps, np.nan, np.nan
+    correction = spread/(m - 1)
+    return crps, crps - correction, crps - (1 - m/M) * correction
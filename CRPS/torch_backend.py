@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PyTorch backend of crps_ensemble. The scores stay on the device of the inputs and are differentiable,
+so they can be used as a training loss. Requires torch (pip install CRPS[torch]).
+
+@author: Naveen GOUTHAM
+"""
+try:
+    import torch
+except ImportError as err:
+    raise ImportError("CRPS.torch_backend requires torch. Install it with: pip install CRPS[torch]") from err
+
+def crps_ensemble(ensemble_members, observations, adjusted_ensemble_size=200, dim=-1):
+    '''
+    Computes the crps, the fcrps, and the acrps for a whole field of ensemble predictions and observations at once.
+
+    Parameters:
+        ensemble_members: torch.Tensor
+            The predicted ensemble members, with the members along dim. They will be sorted automatically.
+            Ex: torch.randn(8,180,360,50,device='cuda')
+        observations: torch.Tensor or float
+            The observed values, broadcastable to the shape of ensemble_members without dim.
+            Ex: torch.randn(8,180,360,device='cuda')
+        adjusted_ensemble_size: int, optional
+            The size the ensemble needs to be adjusted to before computing the Adjusted Continuous Ranked Probability Score.
+            The default is 200.
+        dim: int, optional
+            The dimension of ensemble_members holding the members. The default is -1.
+
+    Returns
+    -------
+    crps, fair-crps, adjusted-crps as torch.Tensor
+        fcrps is the unbiased (fair) estimate. fcrps and acrps are NaN for a single member.
+
+    '''
+    s, _ = torch.sort(torch.movedim(ensemble_members, dim, -1), dim=-1)
+    ob = torch.as_tensor(observations, dtype=s.dtype, device=s.device)
+    m = s.shape[-1]
+    M = int(adjusted_ensemble_size)
+    idx = torch.arange(1, m + 1, dtype=s.dtype, device=s.device)
+    # Integral of F(y) (1 - F(y)) dy, i.e. half the mean absolute difference between members, and
+    # crps = mean |x_e - y| - spread (Gneiting and Raftery, 2007).
+    spread = s @ ((2*idx - m - 1) / (m*m))
+    crps = (s - ob.unsqueeze(-1)).abs().mean(dim=-1) - spread
+    if m == 1:
+        nan = torch.full_like(crps, float('nan'))
+        return crps, nan, nan.clone()
+    correction = spread/(m - 1)
+    fcrps = crps - correction
+    acrps = crps - (1 - (m/M)) * correction
+    return crps, fcrps, acrps
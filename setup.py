@@ -1,9 +1,9 @@
 import pathlib
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 
 HERE = pathlib.Path(__file__).parent
 
-VERSION = '2.0.2'
+VERSION = '3.0.0'
 PACKAGE_NAME = 'CRPS'
 AUTHOR = 'Naveen Goutham'
 AUTHOR_EMAIL = 'naveen.goutham@outlook.com'
@@ -17,6 +17,17 @@ LONG_DESC_TYPE = "text/markdown"
 INSTALL_REQUIRES = [
       'numpy']
 
+# The compiled kernel is optional: without Cython, or when compiling fails, the package falls back to numba or NumPy.
+try:
+    from Cython.Build import cythonize
+    EXT_MODULES = cythonize([Extension('CRPS._crps_c', ['CRPS/_crps_c.pyx'], optional=True)])
+except ImportError:
+    EXT_MODULES = []
+
+EXTRAS_REQUIRE = {
+      'numba': ['numba'],
+      'torch': ['torch']}
+
 setup(name=PACKAGE_NAME,
       version=VERSION,
       description=DESCRIPTION,
@@ -27,6 +38,8 @@ setup(name=PACKAGE_NAME,
       author_email=AUTHOR_EMAIL,
       url=URL,
       install_requires=INSTALL_REQUIRES,
+      extras_require=EXTRAS_REQUIRE,
       keywords=['crps','continuous ranked probability score','fair crps','adjusted crps','proper score','probability score','ensemble forecast','python'],
-      packages=find_packages()
+      packages=find_packages(),
+      ext_modules=EXT_MODULES
       )